@@ -1,15 +1,28 @@
 import os
+import io
+import sys
+import asyncio
+import hashlib
 import subprocess
+import tempfile
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import librosa
 import numpy as np
+import soundfile as sf
+import soxr
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes, CommandHandler, CallbackQueryHandler
-from transformers import pipeline
+from faster_whisper import WhisperModel
 from dotenv import load_dotenv
 import logging
 import re
-from nltk.tokenize import sent_tokenize
+import sqlite3
+import weakref
+from collections import Counter, OrderedDict
+import nltk
 from datetime import datetime
 import utils
 
@@ -26,17 +39,43 @@ load_dotenv()
 # -----------------------------
 # Constants
 # -----------------------------
-FILLERS_RU = utils.FILLERS_RU
-
-FILLERS_EN = utils.FILLERS_EN
-
 OPTIMAL_WPM_MIN = 120
 OPTIMAL_WPM_MAX = 150
+SAMPLE_RATE = 16000
+LLM_CACHE_SIZE = 256
 user_languages = {}
-user_stats = {}
+# Per-user locks; an entry disappears once no handler holds its lock
+_user_locks = weakref.WeakValueDictionary()
+# Audio jobs (download, decode, transcribe, analyze) running at once across all
+# users. A 10-minute clip decodes to ~38 MB of float32 samples before librosa's
+# STFT buffers, and each Whisper transcription is already multithreaded, so a
+# few slots keep the CPU busy without a burst of uploads piling up in memory
+MAX_CONCURRENT_AUDIO = 4
+_audio_slots = asyncio.Semaphore(MAX_CONCURRENT_AUDIO)
 
 TRANSLATIONS = utils.TRANSLATIONS
 
+PROMPT_TEMPLATES = utils.PROMPT_TEMPLATES
+
+# Menu button label in any interface language -> button key
+MENU_BUTTONS = {
+    t[key]: key
+    for t in TRANSLATIONS.values()
+    for key in ('btn_send_audio', 'btn_stats', 'btn_tips', 'btn_settings', 'btn_help')
+}
+
+_WORD_RE = re.compile(r"\b\w+\b")
+
+# Deletion tables for counting script characters via len() differences
+_CYRILLIC_TABLE = str.maketrans('', '', 'абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ')
+_LATIN_TABLE = str.maketrans('', '', 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# Punkt sentence tokenizers, unpickled once instead of on every analysis
+_PUNKT = {
+    "ru": nltk.data.load("tokenizers/punkt/russian.pickle"),
+    "en": nltk.data.load("tokenizers/punkt/english.pickle"),
+}
+
 # -----------------------------
 # API configuration
 # -----------------------------
@@ -46,6 +85,40 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not OPENROUTER_API_KEY or not BOT_TOKEN:
     raise ValueError("Environment variables OPENROUTER_API_KEY or BOT_TOKEN not set")
 
+# Shared HTTP session so TLS connections to OpenRouter are reused
+http_session = requests.Session()
+http_session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.3))
+)
+
+# -----------------------------
+# Statistics storage
+# -----------------------------
+STATS_DB_PATH = os.getenv("STATS_DB_PATH", "stats.db")
+
+
+def init_stats_db(path):
+    """Open the statistics database in WAL mode and create the schema"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            wpm REAL NOT NULL,
+            fillers INTEGER NOT NULL,
+            duration REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_user_id ON stats (user_id)")
+    conn.commit()
+    return conn
+
+
+stats_db = init_stats_db(STATS_DB_PATH)
+
 
 def get_main_keyboard(lang='en'):
     """Create main menu keyboard based on user language"""
@@ -58,8 +131,20 @@ def get_main_keyboard(lang='en'):
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+# Recent LLM answers keyed by prompt digest, oldest first
+_llm_cache = OrderedDict()
+_llm_cache_lock = threading.Lock()
+
+
 def query_llm(prompt, speech_lang):
     """Query Gemma 3 27B via OpenRouter API for speech analysis"""
+    key = (hashlib.blake2b(prompt.encode(), digest_size=16).digest(), speech_lang)
+    # Called from executor threads, so cache access is guarded
+    with _llm_cache_lock:
+        if key in _llm_cache:
+            _llm_cache.move_to_end(key)
+            return _llm_cache[key]
+
     system_content = (
         "You are an expert in public speaking and oratory skills. You analyze speech and provide specific recommendations."
         if speech_lang == "en"
@@ -87,55 +172,54 @@ def query_llm(prompt, speech_lang):
     }
 
     try:
-        response = requests.post(
+        response = http_session.post(
             "https://openrouter.ai/api/v1/chat/completions",
             headers=headers,
             json=payload,
             timeout=60
         )
         response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        content = response.json()["choices"][0]["message"]["content"]
     except requests.exceptions.RequestException as e:
         logger.error(f"API request error: {e}")
         if hasattr(e.response, 'text'):
             logger.error(f"API response: {e.response.text}")
         return "Error getting recommendations. Please try again later." if speech_lang == "en" else "Ошибка при получении рекомендаций. Попробуйте позже."
 
+    # Only successful answers are cached, so errors are retried next time
+    with _llm_cache_lock:
+        _llm_cache[key] = content
+        if len(_llm_cache) > LLM_CACHE_SIZE:
+            _llm_cache.popitem(last=False)
+    return content
 
-def count_fillers(text, lang="ru"):
-    """Count filler words by tokens"""
-    fillers = set(FILLERS_RU if lang == "ru" else FILLERS_EN)
-    words = re.findall(r"\b\w+\b", text.lower())
 
-    filler_details = {}
-    for w in words:
-        if w in fillers:
-            filler_details[w] = filler_details.get(w, 0) + 1
+def _tokenize(text):
+    """Lowercase word tokens shared by the speech and text-quality analyses"""
+    return _WORD_RE.findall(text.lower())
 
-    total_count = sum(filler_details.values())
-    return total_count, filler_details
+
+def count_fillers(text, lang="ru"):
+    """Count filler words and phrases"""
+    filler_details = utils.count_fillers(text, lang)
+    return sum(filler_details.values()), dict(filler_details)
 
 
-def analyze_prosody(y, sr, lang="ru"):
+def analyze_prosody(y, sr, lang="ru", energy=None):
     """Advanced expressiveness analysis: pitch, variability, energy"""
     # Pitch analysis
     pitches, magnitudes = librosa.piptrack(y=y, sr=sr, fmin=75, fmax=350)
-    pitch = []
-    for i in range(pitches.shape[1]):
-        idx = magnitudes[:, i].argmax()
-        val = pitches[idx, i]
-        if val > 0:
-            pitch.append(val)
-
-    pitch = np.array(pitch)
-    if len(pitch) > 10:
-        pitch = librosa.effects.harmonic(pitch)
+    # Strongest bin per frame, voiced frames only
+    idx = np.argmax(magnitudes, axis=0)
+    pitch = pitches[idx, np.arange(pitches.shape[1])]
+    pitch = pitch[pitch > 0]
 
     pitch_var = float(np.std(pitch)) if len(pitch) > 1 else 0
     pitch_mean = float(np.mean(pitch)) if len(pitch) > 1 else 0
 
     # Energy analysis
-    energy = librosa.feature.rms(y=y)[0]
+    if energy is None:
+        energy = librosa.feature.rms(y=y)[0]
     energy_var = float(np.std(energy))
     energy_mean = float(np.mean(energy))
 
@@ -173,14 +257,47 @@ def analyze_prosody(y, sr, lang="ru"):
     }
 
 
-def analyze_speech(audio_path, text, lang="ru"):
+def decode_with_ffmpeg(data):
+    """Decode formats libsndfile can't read (e.g. M4A) via ffmpeg"""
+    # MP4 containers need a seekable input, so hand ffmpeg a temporary file
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        result = subprocess.run(
+            ["ffmpeg", "-i", path, "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=60
+        )
+    finally:
+        os.remove(path)
+    if result.returncode != 0:
+        raise Exception("Audio conversion error")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def load_audio(buffer):
+    """Decode an in-memory audio file to 16 kHz mono float32"""
+    try:
+        y, sr = sf.read(buffer, dtype='float32', always_2d=False)
+    except sf.LibsndfileError:
+        return decode_with_ffmpeg(buffer.getbuffer()), SAMPLE_RATE
+
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    if sr != SAMPLE_RATE:
+        y = soxr.resample(y, sr, SAMPLE_RATE)
+    return y, SAMPLE_RATE
+
+
+def analyze_speech(y, sr, text, lang="ru"):
     """Improved speech analysis: tempo, pauses, fillers, prosody"""
-    y, sr = librosa.load(audio_path, sr=16000)
     duration = librosa.get_duration(y=y, sr=sr)
 
     # Speed (WPM)
-    words = re.findall(r"\b\w+\b", text)
-    wpm = len(words) / (duration / 60) if duration > 0 else 0
+    tokens = _tokenize(text)
+    wpm = len(tokens) / (duration / 60) if duration > 0 else 0
 
     # Tempo rating based on language
     if lang == "en":
@@ -196,77 +313,68 @@ def analyze_speech(audio_path, text, lang="ru"):
             else "слишком быстрый"
         )
 
+    # Frame energy shared by pause detection and prosody
+    energy = librosa.feature.rms(y=y, frame_length=2048, hop_length=512)[0]
+
     # Pauses detection
-    pauses = detect_pauses(y, sr)
-    short_pauses = sum(1 for p in pauses if 0.3 <= p <= 1.0)
-    long_pauses = sum(1 for p in pauses if p > 1.5)
+    pauses = detect_pauses(y, sr, energy)
+    short_pauses = int(np.count_nonzero((pauses >= 0.3) & (pauses <= 1.0)))
+    long_pauses = int(np.count_nonzero(pauses > 1.5))
 
     # Filler words
     fillers_count, filler_details = count_fillers(text, lang)
 
     # Prosody analysis
-    prosody = analyze_prosody(y, sr, lang)
+    prosody = analyze_prosody(y, sr, lang, energy)
+
+    # Text structure, reusing the tokens from the tempo pass
+    text_quality = analyze_text_quality(text, lang, tokens=tokens)
 
     return {
         "duration_sec": round(duration, 2),
-        "word_count": len(words),
+        "word_count": len(tokens),
         "words_per_minute": round(wpm, 1),
         "tempo_rating": tempo_rating,
         "short_pauses": short_pauses,
         "long_pauses": long_pauses,
         "fillers_count": fillers_count,
         "filler_details": filler_details,
-        "prosody": prosody
+        "prosody": prosody,
+        "text_quality": text_quality
     }
 
 
-def detect_pauses(y, sr):
+def detect_pauses(y, sr, energy=None):
     """More accurate pause detection based on energy"""
     hop = 512
     frame_duration = hop / sr
-    energy = librosa.feature.rms(y=y, frame_length=2048, hop_length=hop)[0]
+    if energy is None:
+        energy = librosa.feature.rms(y=y, frame_length=2048, hop_length=hop)[0]
 
     threshold = np.percentile(energy, 15)  # Dynamic threshold
-    silence_frames = np.where(energy < threshold)[0]
+    silent = energy < threshold
 
-    pauses = []
-    if len(silence_frames) == 0:
-        return pauses
+    # Edges of silent runs: +1 at a run's first frame, -1 just past its last
+    edges = np.diff(np.concatenate(([0], silent.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
 
-    start = silence_frames[0]
-    prev = silence_frames[0]
+    durations = (ends - starts) * frame_duration
+    return durations[durations > 0.25]
 
-    for f in silence_frames[1:]:
-        if f - prev > 1:
-            duration = (prev - start) * frame_duration
-            if duration > 0.25:
-                pauses.append(duration)
-            start = f
-        prev = f
 
-    # Add last pause
-    duration = (prev - start) * frame_duration
-    if duration > 0.25:
-        pauses.append(duration)
-
-    return pauses
-
-
-def analyze_text_quality(text, lang="ru"):
+def analyze_text_quality(text, lang="ru", tokens=None):
     """Analyze logic, structure and clarity of text"""
-    language = "russian" if lang == "ru" else "english"
-    sentences = sent_tokenize(text, language=language)
+    sentences = _PUNKT["ru" if lang == "ru" else "en"].tokenize(text)
 
     avg_sentence_len = sum(len(s.split()) for s in sentences) / len(sentences) if sentences else 0
 
     too_long = [s for s in sentences if len(s.split()) > 20]
-    repetitions = {}
 
-    words = re.findall(r"\b\w+\b", text.lower())
-    for w in words:
-        if len(w) > 4:
-            repetitions[w] = repetitions.get(w, 0) + 1
-    repetitions = {w: c for w, c in repetitions.items() if c >= 3}
+    if tokens is None:
+        tokens = _tokenize(text)
+    counts = Counter(w for w in tokens if len(w) > 4)
+    repetitions = {w: c for w, c in counts.items() if c >= 3}
 
     return {
         "sentence_count": len(sentences),
@@ -281,159 +389,61 @@ def prepare_llm_prompt(text, analysis, lang="ru"):
     filler_list = "\n".join([f"  - '{word}': {count} {'times' if lang == 'en' else 'раз'}"
                              for word, count in analysis['filler_details'].items()])
 
-    text_quality = analyze_text_quality(text, lang)
-
-    if lang == "en":
-        prompt = f"""
-Analyze the speech in English and provide specific recommendations for improvement.
-
-📝 SPEECH TEXT:
-{text}
-
-📊 METRICS:
-- Duration: {analysis['duration_sec']} sec
-- Word count: {analysis['word_count']}
-- Speech tempo: {analysis['words_per_minute']} words/min ({analysis['tempo_rating']}, norm: {OPTIMAL_WPM_MIN}-{OPTIMAL_WPM_MAX})
-- Short pauses: {analysis['short_pauses']}
-- Long pauses (hesitations): {analysis['long_pauses']}
-- Filler words: {analysis['fillers_count']} times
-{filler_list if filler_list else "  (none detected)"}
-- Monotony: {analysis['prosody']['monotony']}
-- Volume dynamics: {analysis['prosody']['energy_rating']}
-
-🧠 TEXT STRUCTURE ANALYSIS:
-- Sentence count: {text_quality['sentence_count']}
-- Average sentence length: {text_quality['avg_sentence_length']:.1f} words
-- Too long sentences: {len(text_quality['long_sentences'])}
-- Frequent word repetitions: {text_quality['repetitions']}
-
-📋 TASK
-1) Rate the speech on a scale of 1–10
-Evaluate the following parameters:
- - Correctness (pronunciation + grammar)
- - Logic (structure and coherence)
- - Clarity (clear expression)
- - Speech purity (absence of fillers)
- - Expressiveness (intonation, pause work, emotions)
-
-2) You can only use these HTML tags: <b>, <i>, <u>, <code>, <pre>, <a>, <blockquote>. (other tags are strictly prohibited!):
-
-3) Give 3–5 recommendations for speech improvement
-Recommendations should be:
- - specific,
- - implementable,
- - based on metrics and text.
-
-Focus on:
- - tempo,
- - diction,
- - fillers,
- - structure,
- - expressiveness.
-
-4) Find problematic places in the text
-
-Show specific fragments that sound weak, and suggest 2-3 improved versions of each.
-
-Response format (strictly):
- - 5 ratings (1–10)
- - 5 recommendations in list form
- - Reformulations of problematic phrases
-Write concisely, structured and to the point.
-"""
-    else:
-        prompt = f"""
-Проанализируй речь на русском языке и дай конкретные рекомендации для улучшения.
-
-📝 ТЕКСТ РЕЧИ:
-{text}
-
-📊 МЕТРИКИ:
-- Длительность: {analysis['duration_sec']} сек
-- Количество слов: {analysis['word_count']}
-- Темп речи: {analysis['words_per_minute']} слов/мин ({analysis['tempo_rating']}, норма: {OPTIMAL_WPM_MIN}-{OPTIMAL_WPM_MAX})
-- Короткие паузы: {analysis['short_pauses']}
-- Длинные паузы (заминки): {analysis['long_pauses']}
-- Слова-паразиты: {analysis['fillers_count']} раз
-{filler_list if filler_list else "  (не обнаружено)"}
-- Монотонность: {analysis['prosody']['monotony']}
-- Динамика громкости: {analysis['prosody']['energy_rating']}
-
-🧠 АНАЛИЗ СТРУКТУРЫ ТЕКСТА:
-- Количество предложений: {text_quality['sentence_count']}
-- Средняя длина предложения: {text_quality['avg_sentence_length']:.1f} слов
-- Слишком длинные предложения: {len(text_quality['long_sentences'])}
-- Частые повторы слов: {text_quality['repetitions']}
-
-📋 ЗАДАЧА
-1) Оцени речь по шкале 1–10
-Оцени следующие параметры:
- - Правильность (произношение + грамматика)
- - Логичность (структура и связность)
- - Понятность (ясность изложения)
- - Чистота речи (отсутствие паразитов)
- - Выразительность (интонация, работа с паузами, эмоции)
-
-2) ты можешь только использовать только эти HTML теги: <b>, <i>, <u>, <code>, <pre>, <a>, <blockquote>. (другие тебе строго запрещено использовать) :
-
-3) Дай 3–5 рекомендаций по улучшению речи
-Рекомендации должны быть:
- - конкретными,
- - реализуемыми,
- - основанными на метриках и тексте.
-
-Сфокусируйся на:
- - темпе,
- - дикции,
- - паразитах,
- - структуре,
- - выразительности.
-
-4) Найди проблемные места в тексте
-
-Покажи конкретные фрагменты, которые звучат слабо, и предложи 2-3 улучшенных варианта каждого.
-
-Формат ответа (строго):
- - 5 оценок (1–10)
- - 5 рекомендаций списком
- - Переформулировки проблемных фраз
-Пиши кратко, структурировано и по делу.
-"""
-    return prompt
+    text_quality = analysis.get('text_quality') or analyze_text_quality(text, lang)
+
+    return PROMPT_TEMPLATES["en" if lang == "en" else "ru"].format_map({
+        "text": text,
+        "duration_sec": analysis['duration_sec'],
+        "word_count": analysis['word_count'],
+        "words_per_minute": analysis['words_per_minute'],
+        "tempo_rating": analysis['tempo_rating'],
+        "wpm_min": OPTIMAL_WPM_MIN,
+        "wpm_max": OPTIMAL_WPM_MAX,
+        "short_pauses": analysis['short_pauses'],
+        "long_pauses": analysis['long_pauses'],
+        "fillers_count": analysis['fillers_count'],
+        "filler_list": filler_list or ("  (none detected)" if lang == "en" else "  (не обнаружено)"),
+        "monotony": analysis['prosody']['monotony'],
+        "energy_rating": analysis['prosody']['energy_rating'],
+        "sentence_count": text_quality['sentence_count'],
+        "avg_sentence_length": text_quality['avg_sentence_length'],
+        "long_sentences": len(text_quality['long_sentences']),
+        "repetitions": text_quality['repetitions'],
+    })
 
 
 def format_analysis_response(text, analysis, recommendations, model_name, ui_lang="ru"):
     """Format analysis response based on UI language"""
     t = TRANSLATIONS[ui_lang]
 
-    response = f"{t['analysis_title']}\n"
-    response += f"━━━━━━━━━━━━━━━━━━━━\n\n"
-
-    response += f"{t['basic_metrics']}\n"
-    response += f"⏱ {analysis['duration_sec']} sec | "
-    response += f"📝 {analysis['word_count']} words\n"
-    response += f"⚡️ {analysis['words_per_minute']} wpm ({analysis['tempo_rating']})\n"
-    response += f"⏸ Pauses: {analysis['short_pauses']} short, {analysis['long_pauses']} long\n"
-    response += f"🎯 Fillers: {analysis['fillers_count']}\n"
+    return "".join([
+        f"{t['analysis_title']}\n",
+        "━━━━━━━━━━━━━━━━━━━━\n\n",
 
-    response += f"{t['speech_quality']}\n"
-    response += f"🎵 {analysis['prosody']['monotony']}\n"
-    response += f"🔊 {analysis['prosody']['energy_rating']}\n"
+        f"{t['basic_metrics']}\n",
+        f"⏱ {analysis['duration_sec']} sec | ",
+        f"📝 {analysis['word_count']} words\n",
+        f"⚡️ {analysis['words_per_minute']} wpm ({analysis['tempo_rating']})\n",
+        f"⏸ Pauses: {analysis['short_pauses']} short, {analysis['long_pauses']} long\n",
+        f"🎯 Fillers: {analysis['fillers_count']}\n",
 
-    response += f"{t['transcription']}\n"
-    response += f"<code>{text[:500]}{'...' if len(text) > 500 else ''}</code>\n"
+        f"{t['speech_quality']}\n",
+        f"🎵 {analysis['prosody']['monotony']}\n",
+        f"🔊 {analysis['prosody']['energy_rating']}\n",
 
-    response += f"{t['recommendations']}"
-    response += f"{recommendations}"
+        f"{t['transcription']}\n",
+        f"<code>{text[:500]}{'...' if len(text) > 500 else ''}</code>\n",
 
-    return response
+        t['recommendations'],
+        recommendations,
+    ])
 
 
 def detect_language(text):
     """Simple language detection based on character patterns"""
     # Count Cyrillic vs Latin characters
-    cyrillic_chars = len(re.findall(r'[а-яА-ЯёЁ]', text))
-    latin_chars = len(re.findall(r'[a-zA-Z]', text))
+    cyrillic_chars = len(text) - len(text.translate(_CYRILLIC_TABLE))
+    latin_chars = len(text) - len(text.translate(_LATIN_TABLE))
 
     # If more than 60% Cyrillic, it's Russian
     if cyrillic_chars > latin_chars and cyrillic_chars > len(text) * 0.3:
@@ -442,31 +452,19 @@ def detect_language(text):
 
 
 def update_user_stats(user_id, analysis):
-    """Update user statistics after analysis"""
-    if user_id not in user_stats:
-        user_stats[user_id] = {
-            'total_analyses': 0,
-            'total_wpm': 0,
-            'total_fillers': 0,
-            'last_analysis_date': None,
-            'analyses_history': []
-        }
-
-    stats = user_stats[user_id]
-    stats['total_analyses'] += 1
-    stats['total_wpm'] += analysis['words_per_minute']
-    stats['total_fillers'] += analysis['fillers_count']
-    stats['last_analysis_date'] = datetime.now().strftime('%Y-%m-%d %H:%M')
-
-    # Store last 10 analyses
-    stats['analyses_history'].append({
-        'date': stats['last_analysis_date'],
-        'wpm': analysis['words_per_minute'],
-        'fillers': analysis['fillers_count'],
-        'duration': analysis['duration_sec']
-    })
-    if len(stats['analyses_history']) > 10:
-        stats['analyses_history'].pop(0)
+    """Record an analysis and return the user's total number of analyses"""
+    with stats_db:
+        stats_db.execute(
+            "INSERT INTO stats (user_id, ts, wpm, fillers, duration) VALUES (?, ?, ?, ?, ?)",
+            (
+                user_id,
+                datetime.now().strftime('%Y-%m-%d %H:%M'),
+                analysis['words_per_minute'],
+                analysis['fillers_count'],
+                analysis['duration_sec']
+            )
+        )
+    return stats_db.execute("SELECT COUNT(*) FROM stats WHERE user_id = ?", (user_id,)).fetchone()[0]
 
 
 # -----------------------------
@@ -514,7 +512,12 @@ async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = user_languages.get(user_id, 'en')
     t = TRANSLATIONS[lang]
 
-    if user_id not in user_stats or user_stats[user_id]['total_analyses'] == 0:
+    total_analyses, avg_wpm, avg_fillers, last_analysis_date = stats_db.execute(
+        "SELECT COUNT(*), AVG(wpm), AVG(fillers), MAX(ts) FROM stats WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+
+    if total_analyses == 0:
         await update.message.reply_text(
             t['stats_empty'],
             parse_mode='HTML',
@@ -522,20 +525,25 @@ async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    stats = user_stats[user_id]
-    avg_wpm = round(stats['total_wpm'] / stats['total_analyses'], 1)
-    avg_fillers = round(stats['total_fillers'] / stats['total_analyses'], 1)
-
-    response = t['stats_title']
-    response += f"{t['total_analyses'].format(stats['total_analyses'])}\n"
-    response += f"{t['avg_wpm'].format(avg_wpm)}\n"
-    response += f"{t['avg_fillers'].format(avg_fillers)}\n"
-    response += f"{t['last_analysis'].format(stats['last_analysis_date'])}\n\n"
-
-    # Add progress chart
-    response += "<b>📈 Recent Progress:</b>\n"
-    for i, analysis in enumerate(stats['analyses_history'][-5:], 1):
-        response += f"{i}. {analysis['date']}: {analysis['wpm']} wpm, {analysis['fillers']} fillers\n"
+    avg_wpm = round(avg_wpm, 1)
+    avg_fillers = round(avg_fillers, 1)
+    recent = stats_db.execute(
+        "SELECT ts, wpm, fillers FROM stats WHERE user_id = ? ORDER BY id DESC LIMIT 5",
+        (user_id,)
+    ).fetchall()
+
+    parts = [
+        t['stats_title'],
+        f"{t['total_analyses'].format(total_analyses)}\n",
+        f"{t['avg_wpm'].format(avg_wpm)}\n",
+        f"{t['avg_fillers'].format(avg_fillers)}\n",
+        f"{t['last_analysis'].format(last_analysis_date)}\n\n",
+        # Add progress chart
+        "<b>📈 Recent Progress:</b>\n",
+    ]
+    for i, (date, wpm, fillers) in enumerate(reversed(recent), 1):
+        parts.append(f"{i}. {date}: {wpm} wpm, {fillers} fillers\n")
+    response = "".join(parts)
 
     await update.message.reply_text(
         response,
@@ -597,18 +605,17 @@ async def text_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text button presses from menu"""
     user_id = update.effective_user.id
     lang = user_languages.get(user_id, 'en')
-    t = TRANSLATIONS[lang]
-    text = update.message.text
+    button = MENU_BUTTONS.get(update.message.text)
 
-    if text == t['btn_help'] or text == '❓ Help' or text == '❓ Помощь':
+    if button == 'btn_help':
         await help_handler(update, context)
-    elif text == t['btn_stats'] or text == '📊 My Stats' or text == '📊 Моя статистика':
+    elif button == 'btn_stats':
         await stats_handler(update, context)
-    elif text == t['btn_tips'] or text == '💡 Tips' or text == '💡 Советы':
+    elif button == 'btn_tips':
         await tips_handler(update, context)
-    elif text == t['btn_settings'] or text == '⚙️ Settings' or text == '⚙️ Настройки':
+    elif button == 'btn_settings':
         await settings_handler(update, context)
-    elif text == t['btn_send_audio'] or text == '🎙 Send Audio' or text == '🎙 Отправить аудио':
+    elif button == 'btn_send_audio':
         prompt_text = "🎤 <b>Ready to analyze!</b>\n\nPlease send a voice message or audio file." if lang == 'en' else "🎤 <b>Готов к анализу!</b>\n\nОтправьте голосовое сообщение или аудиофайл."
         await update.message.reply_text(prompt_text, parse_mode='HTML')
 
@@ -634,7 +641,8 @@ async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='HTML'
         )
     elif query.data.startswith('lang_'):
-        selected_lang = query.data.split('_')[1]
+        # Intern the parsed code so TRANSLATIONS lookups hit the identity fast path
+        selected_lang = sys.intern(query.data.split('_')[1])
         user_languages[user_id] = selected_lang
         t = TRANSLATIONS[selected_lang]
 
@@ -683,118 +691,124 @@ async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(t['main_menu'], parse_mode='HTML')
 
 
-pipe = None
+whisper_model = None
 
 
-async def audio_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Audio message handler (supports Russian and English)"""
-    global pipe
-    if pipe is None:
-        pipe = pipeline(
-            "automatic-speech-recognition",
-            model="openai/whisper-medium",
-            chunk_length_s=30,
-            return_timestamps=True,
-        )
-    user_id = update.effective_user.id
-    ui_lang = user_languages.get(user_id, 'en')
-    t = TRANSLATIONS[ui_lang]
+def get_user_lock(user_id):
+    """Return the lock serializing audio processing for one user"""
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
 
-    logger.info(f"Received audio from user {user_id}")
 
-    input_path = None
-    wav_path = None
+def load_asr_model():
+    """Load Whisper Medium with int8 weights (CTranslate2 backend)"""
+    return WhisperModel("medium", device="cpu", compute_type="int8")
 
-    try:
-        # Send processing status message
-        status_message = await update.message.reply_text(t['processing'], parse_mode='HTML')
-
-        # 1. Download audio
-        audio_file = await update.message.audio.get_file() if update.message.audio else await update.message.voice.get_file()
-        input_path = f"temp_audio_{user_id}.ogg"
-        await audio_file.download_to_drive(input_path)
-        logger.info(f"Audio saved: {input_path}")
-
-        # 2. Convert to WAV
-        await status_message.edit_text(t['converting'], parse_mode="HTML")
-        wav_path = f"temp_audio_{user_id}.wav"
-        result = subprocess.run(
-            ["ffmpeg", "-y", "-i", input_path, "-ar", "16000", "-ac", "1", wav_path],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            timeout=60
-        )
-        if result.returncode != 0:
-            raise Exception("Audio conversion error")
-        logger.info(f"Audio converted: {wav_path}")
-
-        # 3. Transcription
-        await status_message.edit_text(t['recognizing'], parse_mode="HTML")
-        result = pipe(wav_path)
-
-        text = result["text"]
-        chunks = result.get("chunks", [])
-        model_name = "Whisper Medium"
-
-        # Detect speech language
-        speech_lang = detect_language(text)
-        logger.info(f"Detected speech language: {speech_lang}")
-
-        logger.info(f"Model: {model_name}, Text length: {len(text)}, Segments: {len(chunks)}")
 
-        # 4. Speech analysis
-        await status_message.edit_text(t['analyzing'], parse_mode="HTML")
-        analysis = analyze_speech(wav_path, text, speech_lang)
+def transcribe(audio):
+    """Transcribe audio, returning the full text and timestamped chunks"""
+    segments, info = whisper_model.transcribe(audio, beam_size=1, vad_filter=True)
+    # segments is a lazy generator: decoding happens while it is consumed
+    chunks = [{"timestamp": (s.start, s.end), "text": s.text} for s in segments]
+    text = "".join(c["text"] for c in chunks)
+    return text, chunks
 
-        # 5. Get LLM recommendations
-        await status_message.edit_text(t['generating'], parse_mode="HTML")
-        prompt = prepare_llm_prompt(text, analysis, speech_lang)
-        recommendations = utils.sanitize_html(query_llm(prompt, speech_lang))
 
-        # 6. Update user statistics
-        update_user_stats(user_id, analysis)
-
-        # 7. Format and send response
-        response = format_analysis_response(text, analysis, recommendations, model_name, ui_lang)
-
-        # Delete status message
-        await status_message.delete()
-
-        # Send result (split if too long)
-        if len(response) > 4096:
-            parts = [response[i:i + 4096] for i in range(0, len(response), 4096)]
-            for part in parts:
-                await update.message.reply_text(part, parse_mode="HTML")
-        else:
-            await update.message.reply_text(response, parse_mode="HTML")
-
-        # Send completion message with stats
-        total_analyses = user_stats[user_id]['total_analyses']
-        completion_msg = t['analysis_complete'].format(total_analyses)
-        await update.message.reply_text(
-            completion_msg,
-            parse_mode='HTML',
-            reply_markup=get_main_keyboard(ui_lang)
-        )
+async def audio_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Audio message handler (supports Russian and English)"""
+    loop = asyncio.get_running_loop()
+    user_id = update.effective_user.id
+    ui_lang = user_languages.get(user_id, 'en')
+    t = TRANSLATIONS[ui_lang]
 
-        logger.info(f"Analysis complete for user {user_id}")
+    logger.info(f"Received audio from user {user_id}")
 
-    except subprocess.TimeoutExpired:
-        await update.message.reply_text(t['timeout_error'], parse_mode='HTML')
-        logger.error("Timeout during audio conversion")
-    except Exception as e:
-        error_msg = t['error'].format(str(e))
-        await update.message.reply_text(error_msg, parse_mode='HTML')
-        logger.error(f"Processing error: {e}", exc_info=True)
-    finally:
-        # Clean up temporary files
-        for path in [input_path, wav_path]:
-            if path and os.path.exists(path):
-                try:
-                    os.remove(path)
-                    logger.info(f"Deleted temporary file: {path}")
-                except Exception as e:
-                    logger.error(f"Could not delete {path}: {e}")
+    # One analysis per user at a time; other users are not blocked
+    async with get_user_lock(user_id):
+        try:
+            # Send processing status message
+            status_message = await update.message.reply_text(t['processing'], parse_mode='HTML')
+
+            # Hold an audio slot until the raw buffer and waveform are released
+            async with _audio_slots:
+                # 1. Download audio
+                audio_file = await update.message.audio.get_file() if update.message.audio else await update.message.voice.get_file()
+                buffer = io.BytesIO()
+                await audio_file.download_to_memory(buffer)
+                buffer.seek(0)
+                logger.info(f"Audio downloaded: {buffer.getbuffer().nbytes} bytes")
+
+                # 2. Decode to 16 kHz mono (status updates overlap with the work)
+                (y, sr), _ = await asyncio.gather(
+                    loop.run_in_executor(None, load_audio, buffer),
+                    status_message.edit_text(t['converting'], parse_mode="HTML")
+                )
+                logger.info(f"Audio decoded: {len(y) / sr:.1f} sec")
+
+                # 3. Transcription
+                (text, chunks), _ = await asyncio.gather(
+                    loop.run_in_executor(None, transcribe, y),
+                    status_message.edit_text(t['recognizing'], parse_mode="HTML")
+                )
+                model_name = "Whisper Medium"
+
+                # Detect speech language
+                speech_lang = detect_language(text)
+                logger.info(f"Detected speech language: {speech_lang}")
+
+                logger.info(f"Model: {model_name}, Text length: {len(text)}, Segments: {len(chunks)}")
+
+                # 4. Speech analysis
+                analysis, _ = await asyncio.gather(
+                    loop.run_in_executor(None, analyze_speech, y, sr, text, speech_lang),
+                    status_message.edit_text(t['analyzing'], parse_mode="HTML")
+                )
+                del buffer, y
+
+            # 5. Get LLM recommendations
+            prompt = prepare_llm_prompt(text, analysis, speech_lang)
+            llm_answer, _ = await asyncio.gather(
+                loop.run_in_executor(None, query_llm, prompt, speech_lang),
+                status_message.edit_text(t['generating'], parse_mode="HTML")
+            )
+            recommendations = utils.sanitize_html(llm_answer)
+
+            # 6. Update user statistics
+            total_analyses = update_user_stats(user_id, analysis)
+
+            # 7. Format and send response
+            response = format_analysis_response(text, analysis, recommendations, model_name, ui_lang)
+
+            # Delete status message
+            await status_message.delete()
+
+            # Send result (split if too long)
+            if len(response) > 4096:
+                parts = [response[i:i + 4096] for i in range(0, len(response), 4096)]
+                for part in parts:
+                    await update.message.reply_text(part, parse_mode="HTML")
+            else:
+                await update.message.reply_text(response, parse_mode="HTML")
+
+            # Send completion message with stats
+            completion_msg = t['analysis_complete'].format(total_analyses)
+            await update.message.reply_text(
+                completion_msg,
+                parse_mode='HTML',
+                reply_markup=get_main_keyboard(ui_lang)
+            )
+
+            logger.info(f"Analysis complete for user {user_id}")
+
+        except subprocess.TimeoutExpired:
+            await update.message.reply_text(t['timeout_error'], parse_mode='HTML')
+            logger.error("Timeout during audio conversion")
+        except Exception as e:
+            error_msg = t['error'].format(str(e))
+            await update.message.reply_text(error_msg, parse_mode='HTML')
+            logger.error(f"Processing error: {e}", exc_info=True)
 
 
 # -----------------------------
@@ -802,9 +816,16 @@ async def audio_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -----------------------------
 def main():
     """Main function to start the bot"""
+    global whisper_model
     logger.info("Starting bot...")
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    # Load Whisper up front so the first user does not pay for it
+    logger.info("Loading speech recognition model...")
+    whisper_model = load_asr_model()
+
+    # Handle updates concurrently so commands never wait behind audio; per-user
+    # locks keep each user's audio in order and _audio_slots bounds the heavy work
+    app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
 
     # Add command handlers
     app.add_handler(CommandHandler("start", start_handler))
@@ -1,20 +1,74 @@
 import re
-
-FILLERS_RU = [
+from collections import Counter
+from functools import lru_cache
+from types import MappingProxyType
+
+
+def _check_fillers(words):
+    """Freeze a filler list, refusing entries the word-bounded matcher would miss"""
+    # Uppercase, padding or a trailing "…" can never match, since the text is
+    # lowercased and \b can't follow "…"; duplicates only bloat the regex
+    bad = sorted({w for w in words if w != w.strip().rstrip("…").strip().lower() or not w})
+    dupes = sorted(w for w, n in Counter(words).items() if n > 1)
+    if bad or dupes:
+        raise ValueError(f"Malformed filler entries: {bad}, duplicates: {dupes}")
+    # Immutable, so the regexes derived below can't go stale
+    return tuple(words)
+
+
+# Lexical fillers only: hesitation sounds are the HESITATIONS_* patterns below,
+# so check whether a word is a filler with find_fillers, which covers both
+FILLERS_RU = _check_fillers([
     "ну", "типа", "короче", "в общем", "как бы", "значит", "понимаешь", "вроде", "собственно", "это самое",
     "вообще", "ещё", "просто", "например", "я думаю", "знаешь", "ладно", "вот", "так сказать", "сразу",
-    "кажется", "так", "эх", "короче говоря", "между прочим", "по сути", "как правило", "в итоге",
+    "кажется", "так", "короче говоря", "между прочим", "по сути", "как правило", "в итоге",
     "в принципе", "честно говоря", "на самом деле", "прямо", "ну вот", "кстати", "при этом",
-    "если честно", "как ни странно", "пожалуй", "типа того", "так вот", "в общем-то", "сильно", "пожалуйста",
-    "эээ", "эмм", "ммм", "ах", "ой", "угу", "ээ…", "эмм…", "мм…", "ах…", "ох", "эх…", "мм-хм", "ааа"
-]
+    "если честно", "как ни странно", "пожалуй", "типа того", "так вот", "в общем-то", "сильно", "пожалуйста"
+])
 
-FILLERS_EN = [
-    "um", "uh", "like", "you know", "basically", "actually", "literally", "sort of", "kind of", "i mean",
+FILLERS_EN = _check_fillers([
+    "like", "you know", "basically", "actually", "literally", "sort of", "kind of", "i mean",
     "right", "okay", "well", "so", "anyway", "honestly", "seriously", "obviously", "definitely", "totally",
     "really", "just", "maybe", "perhaps", "probably", "essentially", "practically", "virtually", "generally",
-    "apparently", "supposedly", "presumably", "allegedly", "hmm", "err", "ah", "oh", "yeah", "yep", "nah"
-]
+    "apparently", "supposedly", "presumably", "allegedly", "yeah", "yep", "nah"
+])
+
+# Hesitation sounds as patterns, so any length of "эээ"/"hmmm" is caught. A
+# bare "мм"/"mm" or "er" is a unit or an abbreviation, not a hesitation
+HESITATIONS_RU = (r"э{2,}м*", r"э+м{2,}", r"м{3,}", r"м+-?хм+", r"а{2,}", r"[аоэ]+х", r"о+й", r"у+гу+")
+HESITATIONS_EN = (r"u+m+", r"u+h+", r"h+m+", r"m{3,}", r"e+r{2,}", r"a+h+", r"o+h+")
+
+# One alternation per language: words longest first so multi-word phrases
+# win, then the single-word hesitation patterns
+_FILLER_RE = {
+    lang: re.compile(
+        r"\b(?:"
+        + "|".join([re.escape(w) for w in sorted(words, key=len, reverse=True)] + list(hesitations))
+        + r")\b"
+    )
+    for lang, words, hesitations in (
+        ("ru", FILLERS_RU, HESITATIONS_RU),
+        ("en", FILLERS_EN, HESITATIONS_EN),
+    )
+}
+
+def find_fillers(text, lang="ru"):
+    """Return every filler occurrence in text, lowercased, from a single scan"""
+    # Patterns are lowercase, so fold the text once instead of per character
+    return _FILLER_RE["ru" if lang == "ru" else "en"].findall(text.lower())
+
+def count_fillers(text, lang="ru"):
+    """Counter of filler occurrences in text, keyed by lowercased filler"""
+    return Counter(find_fillers(text, lang))
+
+
+# Fragments shared verbatim by the ru and en texts
+_ABOUT_TECHNOLOGIES = """• Speech Recognition (Whisper)
+• Audio Processing (Librosa)
+• Natural Language Processing
+• Machine Learning Analysis
+"""
+_GITHUB_LINE = "<b>GitHub:</b> github.com/AmirMakir/SpeechBot\n"
 
 
 TRANSLATIONS = {
@@ -110,17 +164,12 @@ TRANSLATIONS = {
 <b>AI Анализ:</b> Google Gemma 3 27B
 
 <b>Технологии:</b>
-• Speech Recognition (Whisper)
-• Audio Processing (Librosa)
-• Natural Language Processing
-• Machine Learning Analysis
-
+""" + _ABOUT_TECHNOLOGIES + """
 <b>Разработчик:</b> @AmirMakir
 
 💝 Если бот помог вам, расскажите о нем друзьям!
 
-<b>GitHub:</b> github.com/AmirMakir/SpeechBot
-""",
+""" + _GITHUB_LINE,
         'processing': '🎧 <b>Обрабатываю аудио...</b>\n\nЭто займет несколько секунд ⏳',
         'converting': '🔄 <b>Конвертирую аудио...</b>',
         'recognizing': '🎙 <b>Распознаю речь...</b>',
@@ -234,17 +283,12 @@ Russian 🇷🇺 and English 🇬🇧
 <b>AI Analysis:</b> Google Gemma 3 27B
 
 <b>Technologies:</b>
-• Speech Recognition (Whisper)
-• Audio Processing (Librosa)
-• Natural Language Processing
-• Machine Learning Analysis
-
+""" + _ABOUT_TECHNOLOGIES + """
 <b>Developer:</b> @AmirMakir
 
 💝 If the bot helped you, tell your friends!
 
-<b>GitHub:</b> github.com/AmirMakir/SpeechBot
-""",
+""" + _GITHUB_LINE,
         'processing': '🎧 <b>Processing audio...</b>\n\nThis will take a few seconds ⏳',
         'converting': '🔄 <b>Converting audio...</b>',
         'recognizing': '🎙 <b>Recognizing speech...</b>',
@@ -268,17 +312,173 @@ Russian 🇷🇺 and English 🇬🇧
     }
 }
 
+# Fail fast on key drift so lookups for any language can't raise KeyError
+if TRANSLATIONS['ru'].keys() != TRANSLATIONS['en'].keys():
+    raise ValueError(
+        f"Translation keys differ between languages: {sorted(TRANSLATIONS['ru'].keys() ^ TRANSLATIONS['en'].keys())}"
+    )
+
+TRANSLATIONS = {lang: MappingProxyType(texts) for lang, texts in TRANSLATIONS.items()}
+
+
+# LLM prompt templates, filled in with str.format_map by prepare_llm_prompt
+PROMPT_TEMPLATES = {
+    'en': """
+Analyze the speech in English and provide specific recommendations for improvement.
+
+📝 SPEECH TEXT:
+{text}
+
+📊 METRICS:
+- Duration: {duration_sec} sec
+- Word count: {word_count}
+- Speech tempo: {words_per_minute} words/min ({tempo_rating}, norm: {wpm_min}-{wpm_max})
+- Short pauses: {short_pauses}
+- Long pauses (hesitations): {long_pauses}
+- Filler words: {fillers_count} times
+{filler_list}
+- Monotony: {monotony}
+- Volume dynamics: {energy_rating}
+
+🧠 TEXT STRUCTURE ANALYSIS:
+- Sentence count: {sentence_count}
+- Average sentence length: {avg_sentence_length:.1f} words
+- Too long sentences: {long_sentences}
+- Frequent word repetitions: {repetitions}
+
+📋 TASK
+1) Rate the speech on a scale of 1–10
+Evaluate the following parameters:
+ - Correctness (pronunciation + grammar)
+ - Logic (structure and coherence)
+ - Clarity (clear expression)
+ - Speech purity (absence of fillers)
+ - Expressiveness (intonation, pause work, emotions)
+
+2) You can only use these HTML tags: <b>, <i>, <u>, <code>, <pre>, <a>, <blockquote>. (other tags are strictly prohibited!):
+
+3) Give 3–5 recommendations for speech improvement
+Recommendations should be:
+ - specific,
+ - implementable,
+ - based on metrics and text.
+
+Focus on:
+ - tempo,
+ - diction,
+ - fillers,
+ - structure,
+ - expressiveness.
+
+4) Find problematic places in the text
+
+Show specific fragments that sound weak, and suggest 2-3 improved versions of each.
+
+Response format (strictly):
+ - 5 ratings (1–10)
+ - 5 recommendations in list form
+ - Reformulations of problematic phrases
+Write concisely, structured and to the point.
+""",
+    'ru': """
+Проанализируй речь на русском языке и дай конкретные рекомендации для улучшения.
+
+📝 ТЕКСТ РЕЧИ:
+{text}
+
+📊 МЕТРИКИ:
+- Длительность: {duration_sec} сек
+- Количество слов: {word_count}
+- Темп речи: {words_per_minute} слов/мин ({tempo_rating}, норма: {wpm_min}-{wpm_max})
+- Короткие паузы: {short_pauses}
+- Длинные паузы (заминки): {long_pauses}
+- Слова-паразиты: {fillers_count} раз
+{filler_list}
+- Монотонность: {monotony}
+- Динамика громкости: {energy_rating}
+
+🧠 АНАЛИЗ СТРУКТУРЫ ТЕКСТА:
+- Количество предложений: {sentence_count}
+- Средняя длина предложения: {avg_sentence_length:.1f} слов
+- Слишком длинные предложения: {long_sentences}
+- Частые повторы слов: {repetitions}
+
+📋 ЗАДАЧА
+1) Оцени речь по шкале 1–10
+Оцени следующие параметры:
+ - Правильность (произношение + грамматика)
+ - Логичность (структура и связность)
+ - Понятность (ясность изложения)
+ - Чистота речи (отсутствие паразитов)
+ - Выразительность (интонация, работа с паузами, эмоции)
+
+2) ты можешь только использовать только эти HTML теги: <b>, <i>, <u>, <code>, <pre>, <a>, <blockquote>. (другие тебе строго запрещено использовать) :
+
+3) Дай 3–5 рекомендаций по улучшению речи
+Рекомендации должны быть:
+ - конкретными,
+ - реализуемыми,
+ - основанными на метриках и тексте.
+
+Сфокусируйся на:
+ - темпе,
+ - дикции,
+ - паразитах,
+ - структуре,
+ - выразительности.
+
+4) Найди проблемные места в тексте
+
+Покажи конкретные фрагменты, которые звучат слабо, и предложи 2-3 улучшенных варианта каждого.
+
+Формат ответа (строго):
+ - 5 оценок (1–10)
+ - 5 рекомендаций списком
+ - Переформулировки проблемных фраз
+Пиши кратко, структурировано и по делу.
+""",
+}
+
 
 ALLOWED_TAGS = ["b", "i", "u", "code", "pre", "a", "blockquote"]
 
-def sanitize_html(text):
-    allowed = "|".join(ALLOWED_TAGS)
+_ALLOWED = frozenset(t.lower() for t in ALLOWED_TAGS)
 
-    text = re.sub(
-        rf"</?(?!({allowed})(\s+href=\"[^\"]+\")?)[a-zA-Z0-9]+.*?>",
-        "",
-        text,
-        flags=re.IGNORECASE
-    )
+# A tag name starts with a letter and ends at whitespace, "/" or ">"; a tag
+# never spans a line or contains another "<". Anything else ("<3", "x < y")
+# is text, so a stray "<" in prose can't swallow the text up to a later ">"
+_TAG_RE = re.compile(r"</?([A-Za-z][A-Za-z0-9]*)(?=[\s/>])[^<>\n]*>")
+
+def _sanitize_uncached(text):
+    """Drop every tag Telegram's HTML mode doesn't allow, in one linear pass"""
+    parts = []
+    pos = 0
+    while True:
+        start = text.find("<", pos)
+        if start == -1:
+            break
+
+        match = _TAG_RE.match(text, start)
+        if match is None:
+            # Not a tag (e.g. "a < b", "<3"): Telegram rejects a bare "<", so escape it
+            parts.append(text[pos:start])
+            parts.append("&lt;")
+            pos = start + 1
+            continue
+
+        parts.append(text[pos:start])
+        if match.group(1).lower() in _ALLOWED:
+            parts.append(match.group())
+        pos = match.end()
 
-    return text
\ No newline at end of file
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+_sanitize_cached = lru_cache(maxsize=1024)(_sanitize_uncached)
+
+def sanitize_html(text):
+    # Long one-off texts would only evict useful entries from the cache
+    if len(text) > 4096:
+        return _sanitize_uncached(text)
+    return _sanitize_cached(text)